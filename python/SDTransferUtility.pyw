@@ -7,17 +7,26 @@ Created on Mon Dec 09 14:57:26 2013
 
 import os
 import os.path as osp
+import errno
 import logging
+import shutil
 
 from sys import argv
 from datetime import datetime
 from glob import glob
 
-from Tkinter import *
-from tkFileDialog import askdirectory, asksaveasfilename
-from tkMessageBox import showerror
-from ScrolledText import ScrolledText
-from ttk import Treeview
+try:
+    from Tkinter import *
+    from tkFileDialog import askdirectory, asksaveasfilename
+    from tkMessageBox import showerror
+    from ScrolledText import ScrolledText
+    from ttk import Treeview
+except ImportError: # Python 3
+    from tkinter import *
+    from tkinter.filedialog import askdirectory, asksaveasfilename
+    from tkinter.messagebox import showerror
+    from tkinter.scrolledtext import ScrolledText
+    from tkinter.ttk import Treeview
 
 try:
     # Homepage: https://github.com/ianare/exif-py
@@ -30,12 +39,10 @@ except ImportError:
     showerror(title='Missing module', message=msg)
     exit()
 
-from PIL import Image, ImageTk
-
 from win32file import GetDriveType, DRIVE_REMOVABLE
 
-from definitions.sites import site_list
-from definitions.paths import TIMELAPSE_PHOTOS
+from definitions.sites import site_codes
+from definitions.paths import site_paths
 from version import version as __version__
 
 
@@ -43,6 +50,52 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.NullHandler())
 
+# Disk ejecting software ships alongside this script
+EJECT_EXE = osp.join(osp.dirname(osp.abspath(argv[0])), 'usb_disk_eject.exe')
+
+# Images moved concurrently; overlaps slow card reads with destination writes
+MOVE_THREADS = 4
+
+# Chunk size for cross-volume copies; fewer, larger reads from the card
+COPY_BUFSIZE = 1024 * 1024
+
+
+def move_file(src, dst):
+    """Move file `src` to `dst` without replacing an existing `dst`
+
+    Python 2's os.rename (MoveFile) crosses volumes on its own but Python 3's
+    does not, so fall back to an exclusive-create copy then delete the source.
+
+    Returns None once `src` is gone. If `src` was copied but could not be
+    removed afterwards (e.g. write-protected card), the image is archived
+    anyway and the error from removing `src` is returned instead of raised.
+    """
+    try:
+        os.rename(src, dst)
+        return None
+    except OSError:
+        if osp.exists(dst) or not osp.isfile(src):
+            raise
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    fd = os.open(dst, flags) # fails if `dst` appeared meanwhile
+    copied = False
+    try:
+        with os.fdopen(fd, 'wb') as fdst, open(src, 'rb') as fsrc:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+        shutil.copystat(src, dst)
+        copied = True
+    finally:
+        if not copied:
+            try:
+                os.remove(dst) # don't leave a partial copy behind
+            except OSError:
+                pass # report the original error, not this one
+    try:
+        os.remove(src)
+    except OSError as e:
+        return e
+    return None
+
 
 class SDTransferUtility(Frame):
     """GUI program for transferring timelapse images from SD cards"""
@@ -53,6 +106,8 @@ class SDTransferUtility(Frame):
 
         self._prog_title = 'Timelapse Image Transfer Utility'
         self._sources = {}
+        self._fname_masks = {}
+        self._popup_row = None # treeview row under site menu pop-up
         self._log_output = IntVar(value=0)
         self._log_fname = StringVar(value='')
         self._search_dir = StringVar()
@@ -151,6 +206,18 @@ class SDTransferUtility(Frame):
                                     selectmode='browse')
         self._sourcetree.heading('destname', text='Destination', anchor=W)
         self._sourcetree.pack(side=TOP, expand=YES, fill=BOTH)
+        self._sourcetree.tag_bind('dir', sequence='<Button-3>',
+                                  callback=self.__gui_popup)
+        self._sourcetree.bind('<<TreeviewSelect>>',
+                              lambda event: self.__preview_img())
+
+        # site menu never changes; build once
+        self._site_menu = Menu(self, tearoff=0)
+        for code in site_codes:
+            def make_caller(code):
+                return lambda: self.__set_srcdir_site(iid=self._popup_row,
+                                                      code=code)
+            self._site_menu.add_command(label=code, command=make_caller(code))
         return thispane
 
 
@@ -170,7 +237,7 @@ class SDTransferUtility(Frame):
             self.text = widget
 
         def emit(self, record):
-            self.text.insert(END, record.msg + '\n')
+            self.text.insert(END, record.getMessage() + '\n')
             self.text.see(END)
 
 
@@ -222,15 +289,8 @@ class SDTransferUtility(Frame):
 
     def __gui_popup(self, event):
         """Pop-up context menu for selecting site"""
-        w = self._sourcetree
-        row = w.identify_row(event.y)
-        menu = Menu(tearoff=0)
-        for site in site_list:
-            def make_caller(iid, code):
-                return lambda: self.__set_srcdir_site(iid=iid, code=code)
-            site = site.code
-            menu.add_command(label=site, command=make_caller(row, site))
-        menu.post(event.x_root, event.y_root)
+        self._popup_row = self._sourcetree.identify_row(event.y)
+        self._site_menu.post(event.x_root, event.y_root)
 
 
     ##### GUI ^ / LOGIC v #####
@@ -246,13 +306,14 @@ class SDTransferUtility(Frame):
             self.__enable_eject_btn()
             if choice != oldchoice:
                 self._sources.clear()
+                self._fname_masks.clear()
                 self.__refresh_treeview()
 
 
     def __set_srcdir_site(self, iid, code):
         """set key from None to site's code"""
         srcdir = self._sourcetree.item(iid, option='text')
-        destdir = TIMELAPSE_PHOTOS % {'site' : code}
+        destdir = site_paths(code).timelapse_photos
         self._sources[srcdir]['dest_dir'] = destdir
         self._sources[srcdir]['site_code'] = code
 
@@ -283,11 +344,10 @@ class SDTransferUtility(Frame):
     def __enable_processing(self):
         """if conditions are OK, enable the 'begin processing' button"""
         state = NORMAL
-        for _, info in self._sources.items():
-            if not info['dest_dir']:
-                state = DISABLED
-            if not info['site_code']:
+        for info in self._sources.values():
+            if not info['dest_dir'] or not info['site_code']:
                 state = DISABLED
+                break # one unassigned dir is enough
         self.__begin_proc_btn.configure(state=state)
 
 
@@ -296,6 +356,7 @@ class SDTransferUtility(Frame):
         globstr = osp.join(self._search_dir.get(), self._search_str.get())
         files_found = glob(globstr)
         self._sources.clear()
+        self._fname_masks.clear() # card may have been swapped
         for f in files_found:
             this_dir = self._sources.setdefault(osp.dirname(f), {})
             this_dir.setdefault('dest_dir', None) # not used
@@ -320,7 +381,7 @@ class SDTransferUtility(Frame):
             w.delete(row)
 
         # populate
-        for src_dir in sorted(self._sources.keys()):
+        for src_dir in sorted(self._sources):
             dest_dir = self._sources[src_dir]['dest_dir']
             dest_names = self._sources[src_dir]['dest_names']
             site_code = self._sources[src_dir]['site_code']
@@ -328,15 +389,13 @@ class SDTransferUtility(Frame):
             dest_str = dest_dir or '<not yet determined>'
             w.insert('', END, iid=src_dir, text=src_dir,
                      tag='dir', values=[dest_str])
-            for src_name in sorted(dest_names.keys()):
+            for src_name in sorted(dest_names):
                 dest_name = self.__dest_fname_mask(src_name)
                 if site_code:
                     dest_name = dest_name % {'code' : site_code}
                     dest_names[src_name] = dest_name
                 w.insert(src_dir, END, text=osp.basename(src_name), tag='img',
                          iid=src_name, values=[dest_name])
-        w.tag_bind('dir', sequence='<Button-3>', callback=self.__gui_popup)
-        w.bind('<<TreeviewSelect>>', lambda event: self.__preview_img())
 
         # restore open tree controls & select previous item
         topchildren = w.get_children()
@@ -353,7 +412,7 @@ class SDTransferUtility(Frame):
         w = self._sourcetree
         if w.focus():
             fname = w.item(w.focus(), option='text')
-            if fname in self._sources.keys():
+            if fname in self._sources:
                 if self._preview_img:
                     self._preview.configure(text='', image=None)
                     self._preview_img = None
@@ -361,10 +420,15 @@ class SDTransferUtility(Frame):
                 srcdir = w.item(w.parent(w.focus()), option='text')
                 imgpath = osp.join(srcdir, fname)
                 try:
+                    # deferred until first preview; PIL is slow to import
+                    from PIL import Image, ImageTk
+                    # ANTIALIAS was renamed LANCZOS, dropped in Pillow 10
+                    resample = (getattr(Image, 'LANCZOS', None)
+                                or Image.ANTIALIAS)
                     img = Image.open(imgpath)
                     wd = self._preview.winfo_width() # button dimensions
                     ht = self._preview.winfo_height() - 25 # text label space
-                    img.thumbnail((wd,ht), Image.ANTIALIAS)
+                    img.thumbnail((wd,ht), resample)
                     self._preview_img = ImageTk.PhotoImage(img)
                     self._preview.configure(text=imgpath,
                                             image=self._preview_img,
@@ -373,8 +437,8 @@ class SDTransferUtility(Frame):
                     self._preview.configure(text='<Preview not available>',
                                             image=None)
                     self._preview_img = None
-                    logger.debug('Exception prevented image preview load:\n'
-                                 + ex.message)
+                    logger.debug('Exception prevented image preview load:\n%s',
+                                 ex)
 
 
     def __dest_fname_mask(self, fname):
@@ -382,14 +446,22 @@ class SDTransferUtility(Frame):
 
         In form of `%(site)s_YYYYMMDD.hhmm` YYYYMMDD is year/month/day, hhmm
         is (24) hour/min, and %(site)s is for dict-style string substitution.
+        Masks are cached per file since reading EXIF tags means opening the
+        image; the cache is cleared whenever a new search is run.
         """
+        try:
+            return self._fname_masks[fname]
+        except KeyError:
+            pass
         _, ext = osp.splitext(fname)
-        tags = get_exif_tags(open(fname, mode='rb'),
-                             details=False,
-                             stop_tag='DateTimeOriginal')
+        with open(fname, mode='rb') as f:
+            tags = get_exif_tags(f, details=False,
+                                 stop_tag='DateTimeOriginal')
         timestamp = str(tags['EXIF DateTimeOriginal'])
         dt = datetime.strptime(timestamp, '%Y:%m:%d %H:%M:%S')
-        return dt.strftime('%%(code)s_%Y%m%d.%H%M'+ext.lower())
+        mask = dt.strftime('%%(code)s_%Y%m%d.%H%M'+ext.lower())
+        self._fname_masks[fname] = mask
+        return mask
 
 
     def __transfer_images(self):
@@ -398,43 +470,95 @@ class SDTransferUtility(Frame):
             self._preview.configure(text='', image=None) # de-associate
             self._preview_img = None # then release image file
 
+        # deferred until first transfer; multiprocessing is slow to import
+        from multiprocessing.pool import ThreadPool
+
         dirs_to_remove = []
-        for srcdir, info in sorted(self._sources.items()):
-            dest_names = info['dest_names']
-            if not dest_names:
-                continue
-            dest_dir = info['dest_dir']
-            try:
-                os.makedirs(dest_dir)
-            except OSError as e:
-                if not osp.isdir(dest_dir):
-                    raise e
-            files_to_remove = []
-            for src_path, dest_file in sorted(dest_names.items()):
-                dest_path = osp.join(dest_dir, dest_file)
-                moved = self.__move_image(src_path, dest_path)
-                if moved:
-                    files_to_remove.append(src_path)
-            for ea in files_to_remove:
-                dest_names.pop(ea) # remove file name if moved
-            if not dest_names:
-                dirs_to_remove.append(srcdir)
+        pool = ThreadPool(MOVE_THREADS)
+        try:
+            for srcdir, info in sorted(self._sources.items()):
+                dest_names = info['dest_names']
+                if not dest_names:
+                    continue
+                dest_dir = info['dest_dir']
+                try:
+                    os.makedirs(dest_dir)
+                except OSError as e:
+                    if not osp.isdir(dest_dir):
+                        raise e
+                dest_prefix = osp.join(dest_dir, '') # dest_file is bare name
+                total = len(dest_names)
+                failed = []
+                kept = [] # archived but source could not be removed
+                # names only resolve to the minute, so images sharing one go
+                # to the same worker and are tried in order until one moves
+                groups = {}
+                for src_path, dest_file in sorted(dest_names.items()):
+                    groups.setdefault(dest_prefix + dest_file,
+                                      []).append(src_path)
+                # log from this thread only; Tk widgets are not thread-safe
+                results = pool.imap(lambda args: self.__move_first(*args),
+                                    sorted(groups.items()))
+                for dest_path, attempts in zip(sorted(groups), results):
+                    for src_path, moved, why in attempts:
+                        if not moved:
+                            failed.append('%s:  %s' % (src_path, why))
+                            continue
+                        logger.debug('Moved %s to %s', src_path, dest_path)
+                        dest_names.pop(src_path) # remove file name if moved
+                        if why:
+                            kept.append('%s:  %s' % (src_path, why))
+                logger.info('Moved %d of %d images from %s to %s',
+                            total - len(failed), total, srcdir, dest_dir)
+                if kept:
+                    logger.warning('Copied %d file(s) but could not remove '
+                                   'source:\n  %s',
+                                   len(kept), '\n  '.join(sorted(kept)))
+                if failed:
+                    logger.info('Error moving %d file(s) (skipped):\n  %s',
+                                len(failed), '\n  '.join(sorted(failed)))
+                if not dest_names:
+                    dirs_to_remove.append(srcdir)
+        finally:
+            pool.close()
+            pool.join()
         for ea in dirs_to_remove:
             self._sources.pop(ea, None) # remove dirs with no files left
 
         self.__refresh_treeview()
 
 
+    def __move_first(self, dst, srcs):
+        """Move first of `srcs` that succeeds to `dst`; threadable
+
+        Returns list of (src, moved, reason) tuples, one per item of `srcs`,
+        as for __move_image(). Sources after the one that moved are not tried.
+        """
+        attempts = []
+        done = False
+        for src in srcs:
+            if done:
+                attempts.append((src, False, 'destination name already used'))
+                continue
+            done, why = self.__move_image(src, dst)
+            attempts.append((src, done, why))
+        return attempts
+
+
     def __move_image(self, src, dst):
-        """Move single image; threadable"""
+        """Move single image; threadable
+
+        Returns tuple (moved, reason): `moved` is True once the image is at
+        `dst`; `reason` says why it failed or, if moved, why the source is
+        still present. `reason` is None for a clean move.
+        """
         try:
-            os.rename(src, dst)
-            logger.info('Moved %s to %s' % (src, dst))
-            return True
-        except WindowsError as err:
-            logger.info('Error moving %s (file skipped):  %s' %
-                        (src, err.strerror))
-            return False
+            src_err = move_file(src, dst)
+        except EnvironmentError as err:
+            return False, err.strerror or str(err)
+        if src_err:
+            return True, src_err.strerror or str(src_err)
+        return True, None
 
 
     def __eject_srch_dir(self):
@@ -446,17 +570,16 @@ class SDTransferUtility(Frame):
         if GetDriveType(drive) != DRIVE_REMOVABLE:
             logger.info('NOT A REMOVABLE DRIVE!')
             return
-        if not osp.isfile('usb_disk_eject.exe'):
-            logger.info('CANNOT FIND DISK EJECTING SOFTWARE!')
-            return
         try:
+            import subprocess # only needed here
             driveletter = drive.strip(':')
-            cwd = osp.dirname(argv[0])
-            eject = osp.join('"'+cwd, 'usb_disk_eject.exe" /REMOVELETTER %s')
-            os.system(eject % driveletter)
+            subprocess.check_call([EJECT_EXE, '/REMOVELETTER', driveletter])
             logger.info('SUCCESS EJECTING DISK!')
         except Exception as err:
-            logger.info('WAS NOT ABLE TO EXIT! Exception:\n' + err.message)
+            if getattr(err, 'errno', None) == errno.ENOENT:
+                logger.info('CANNOT FIND DISK EJECTING SOFTWARE!')
+            else:
+                logger.info('WAS NOT ABLE TO EXIT! Exception:\n%s', err)
 
 
     def __quit(self):
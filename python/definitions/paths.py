@@ -7,8 +7,9 @@
 """
 
 import os.path as osp
+from collections import namedtuple
 
-from version import version as __version__
+from definitions.sites import site_list
 
 #### Valid path substitions
 # These are the canonical available path substitutions. Not every script will
@@ -25,6 +26,11 @@ from version import version as __version__
 #               ("tsdata", "site_info", "stats30", ...)
 
 
+def _path(*parts):
+    """Join and normalize path components once, at import"""
+    return osp.normpath(osp.join(*parts))
+
+
 # Base directory for project
 HOME = r'B:\proj\2011_REACCH' # for lar-d216-share.cee.wsu.edu
 
@@ -32,22 +38,57 @@ HOME = r'B:\proj\2011_REACCH' # for lar-d216-share.cee.wsu.edu
 TELEMETRY_SRC = r'C:\Campbellsci\Loggernet' # for lar-d216-share.cee.wsu.edu
 
 #### Agweathernet data storage location
-AGWEATHERNET = osp.join(HOME, 'agweathernet_data')
+AGWEATHERNET = _path(HOME, 'agweathernet_data')
 
 # Destination directory mask for monitoring towers
-TOWERDATA = osp.join(HOME, r'tower_%(site)s')
+TOWERDATA = _path(HOME, r'tower_%(site)s')
 
 # Monitoring tower data files
-RAW_BINARY = osp.join(TOWERDATA, r'L0_raw_binary') # copies from cards
-RAW_ASCII = osp.join(TOWERDATA, r'L0_raw_ascii') # plain-text conversions
-RAW_STDFMT = osp.join(TOWERDATA, r'L0_standard_format') # after standardizing
-TELEMETRY = osp.join(TOWERDATA, r'L0_telemetry') # standardized telemetry data
+RAW_BINARY = _path(TOWERDATA, r'L0_raw_binary') # copies from cards
+RAW_ASCII = _path(TOWERDATA, r'L0_raw_ascii') # plain-text conversions
+RAW_STDFMT = _path(TOWERDATA, r'L0_standard_format') # after standardizing
+TELEMETRY = _path(TOWERDATA, r'L0_telemetry') # standardized telemetry data
 
 # Monitoring tower timelapse cameras
-TIMELAPSE_PHOTOS = osp.join(TOWERDATA, 'photos_timelapsecam') # captured images
-TIMELAPSE_VIDEOS = osp.join(TOWERDATA, 'videos_timelapse') # produced videos
+TIMELAPSE_PHOTOS = _path(TOWERDATA, 'photos_timelapsecam') # captured images
+TIMELAPSE_VIDEOS = _path(TOWERDATA, 'videos_timelapse') # produced videos
 
 # Script log files
-LOGDIR = osp.join(HOME, r'scripts\logs')
-TELEMETRY_LOG = osp.join(LOGDIR, 'process_new_telemetry_data.log')
+LOGDIR = _path(HOME, 'scripts', 'logs')
+TELEMETRY_LOG = _path(LOGDIR, 'process_new_telemetry_data.log')
+
+
+
+#### Per-site paths
+# Substituting `%(site)s` re-parses the mask every time, so do it once per site
+# code (all known sites are resolved at import) and hand back the same
+# read-only record on later calls:
+#
+#   >>>> site_paths('CFNT').timelapse_photos
+#   B:\proj\2011_REACCH\tower_CFNT\photos_timelapsecam
+
+SitePaths = namedtuple('SitePaths', ['towerdata', 'raw_binary', 'raw_ascii',
+                                     'raw_stdfmt', 'telemetry',
+                                     'timelapse_photos', 'timelapse_videos'])
+
+_site_path_cache = {}
+
+def site_paths(code):
+    """Return SitePaths of tower paths with site `code` already substituted"""
+    try:
+        return _site_path_cache[code]
+    except KeyError:
+        subs = {'site' : code}
+        paths = SitePaths(towerdata=TOWERDATA % subs,
+                          raw_binary=RAW_BINARY % subs,
+                          raw_ascii=RAW_ASCII % subs,
+                          raw_stdfmt=RAW_STDFMT % subs,
+                          telemetry=TELEMETRY % subs,
+                          timelapse_photos=TIMELAPSE_PHOTOS % subs,
+                          timelapse_videos=TIMELAPSE_VIDEOS % subs)
+        _site_path_cache[code] = paths
+        return paths
 
+for _site in site_list:
+    site_paths(_site.code)
+del _site
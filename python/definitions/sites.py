@@ -5,41 +5,59 @@
 
         from definitions.sites import site_list
 
+    or one of the lookups built once at import (sn2code, code2sn, code2site,
+    sn2site) to find a site by code or logger serial number.
+
 @author: Patrick O'Keeffe <pokeeffe@wsu.edu>
 """
 
-from version import version as __version__
+from collections import namedtuple
+
+
+__all__ = ['Site', 'site_list', 'site_codes', 'site_SNs', 'sn2code', 'code2sn',
+           'code2site', 'sn2site']
+
+
+Site = namedtuple('Site', ['name', 'code', 'serial_num'])
 
+cfnt = Site(name='Cook Agronomy Farm no-till',
+            code='CFNT',
+            serial_num=6034)
 
-class cfnt():
-    name = 'Cook Agronomy Farm no-till'
-    code = 'CFNT'
-    serial_num = '6034'
+lind = Site(name='Lind Dryland Research Station',
+            code='LIND',
+            serial_num=6035)
 
-class lind():
-    name = 'Lind Dryland Research Station'
-    code = 'LIND'
-    serial_num = '6035'
+cfct = Site(name='Cook Agronomy Farm conventional till',
+            code='CFCT',
+            serial_num=6503)
 
-class cfct():
-    name = 'Cook Agronomy Farm conventional till'
-    code = 'CFCT'
-    serial_num = '6503'
+mmtn = Site(name='Moscow Mountain high rainfall',
+            code='MMTN',
+            serial_num=6504)
 
-class mmtn():
-    name = 'Moscow Mountain high rainfall'
-    code = 'MMTN'
-    serial_num = '6504'
+mslk = Site(name='Moses Lake irrigated',
+            code='MSLK',
+            serial_num=6505)
 
-class mslk():
-    name = 'Moses Lake irrigated'
-    code = 'MSLK'
-    serial_num = '6505'
 
+site_list = (cfnt, cfct, mmtn, lind, mslk)
 
-site_list = [cfnt, cfct, mmtn, lind, mslk]
 
+site_codes = []
+sn2code = {}
+code2sn = {}
+code2site = {}
+sn2site = {}
+for site in site_list:
+    site_codes.append(site.code)
+    sn2code[site.serial_num] = site.code
+    code2sn[site.code] = site.serial_num
+    code2site[site.code] = site
+    sn2site[site.serial_num] = site
+del site
 
-sn2code = dict([[site.serial_num, site.code] for site in site_list])
+site_codes = tuple(site_codes) # same order as site_list
+site_SNs = frozenset(sn2code) # for "is this logger ours?" tests
 
 